@@ -1,93 +1,340 @@
 import os
 import asyncio
-from typing import Optional
+import functools
+import gc
+import hashlib
+import logging
+import wave
+from typing import AsyncIterator, Optional
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
-from livekit import agents
-from livekit.agents import AgentSession, Agent, RoomInputOptions
-from livekit.plugins import openai, silero
+import httpx
+from openai import AsyncOpenAI
 
-# Load environment variables
-load_dotenv()
+from livekit import agents, rtc
+from livekit.agents import AgentSession, Agent, APIConnectOptions
+from livekit.agents.voice.agent_session import SessionConnectOptions
+# Plugins must register on the main thread at import (and be visible to
+# `download-files`), so they stay here; model loading is deferred to prewarm
+from livekit.plugins import cartesia, deepgram, openai, silero
+
+try:
+    import uvloop
+except ImportError:  # Not available on Windows
+    uvloop = None
+
+# Load environment variables only when run as a script; job processes
+# inherit them from the worker and importers get no filesystem side effects
+if __name__ == "__main__":
+    load_dotenv()
+
+logger = logging.getLogger("androfit")
+
+def install_uvloop():
+    """Use uvloop for event loops created after this call, where available"""
+    if uvloop is not None:
+        # Version-bound: uvloop.install() warns from 3.12 and the policy API
+        # itself is deprecated from 3.14. livekit creates its own loops, so
+        # there is no loop_factory hook to move to yet
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+# Only the worker script ("__main__") and the job processes it spawns
+# ("__mp_main__", the name multiprocessing re-imports the script under)
+# switch loops; a plain `import main` from tools or tests is unaffected
+if __name__ in ("__main__", "__mp_main__"):
+    install_uvloop()
 
 class MemoryOptimizedConfig:
     """Configuration optimized for 512MB RAM"""
+    # Streaming Deepgram STT when a key is configured, Whisper otherwise
+    STT_PROVIDER = (os.getenv("STT_PROVIDER") or ("deepgram" if os.getenv("DEEPGRAM_API_KEY") else "openai")).strip().lower()
+    DEEPGRAM_STT_MODEL = "nova-3"
+    
+    # Websocket Cartesia TTS when a key is configured, OpenAI HTTP TTS otherwise
+    TTS_PROVIDER = (os.getenv("TTS_PROVIDER") or ("cartesia" if os.getenv("CARTESIA_API_KEY") else "openai")).strip().lower()
+    CARTESIA_TTS_MODEL = "sonic-2"  # Uses the plugin's default voice
+    TTS_LANGUAGE = "en"
+    
     # Use smaller models and reduce buffer sizes
     STT_MODEL = "whisper-1"  # Smallest Whisper model
+    STT_LANGUAGE = "en"  # Skip Whisper's language detection pass
+    STT_PROMPT = "fitness workout coaching reps sets"  # Bias toward gym vocabulary
     LLM_MODEL = "gpt-4o-mini"  # Most efficient GPT model
+    # Speech-to-speech over one websocket, replacing STT/LLM/TTS (higher cost)
+    USE_REALTIME = os.getenv("USE_REALTIME", "").lower() in ("1", "true", "yes")
+    REALTIME_MODEL = "gpt-4o-realtime-preview"
     TTS_MODEL = "gpt-4o-mini-tts"  # Standard TTS model
     TTS_VOICE = "alloy"
     
+    # Static greeting is synthesized once and replayed from disk afterwards
+    GREETING = "Hello! I'm AndrofitAI, your personal AI fitness coach. What are your fitness goals today?"
+    GREETING_AUDIO_PATH = os.getenv("GREETING_AUDIO_PATH")  # Derived from the TTS settings if unset
+    
+    # Request bounds so a stalled OpenAI call fails over quickly
+    LLM_TIMEOUT = 8.0  # seconds, whole request
+    TTS_TIMEOUT = 5.0  # seconds to connect; the plugin fixes reads at 30s
+    REQUEST_RETRIES = 2
+    RETRY_INTERVAL = 0.5  # seconds
+    
     # Memory limits
     MAX_AUDIO_BUFFER_SIZE = 1024 * 1024  # 1MB audio buffer
     MAX_RESPONSE_LENGTH = 500  # Limit response tokens
 
+_REQUIRED_ENV = ('OPENAI_API_KEY', 'LIVEKIT_API_KEY', 'LIVEKIT_API_SECRET', 'LIVEKIT_URL')
+_STT_PROVIDERS = ('deepgram', 'openai')
+_TTS_PROVIDERS = ('cartesia', 'openai')
+
+@functools.lru_cache(maxsize=1)
 def validate_environment():
     """Validate environment variables efficiently"""
-    required = ['OPENAI_API_KEY', 'LIVEKIT_API_KEY', 'LIVEKIT_API_SECRET', 'LIVEKIT_URL']
-    missing = [var for var in required if not os.getenv(var) or os.getenv(var).startswith('your_')]
+    if MemoryOptimizedConfig.STT_PROVIDER not in _STT_PROVIDERS:
+        raise ValueError(
+            f"Unsupported STT_PROVIDER {MemoryOptimizedConfig.STT_PROVIDER!r}; "
+            f"expected one of: {', '.join(_STT_PROVIDERS)}"
+        )
+    if MemoryOptimizedConfig.TTS_PROVIDER not in _TTS_PROVIDERS:
+        raise ValueError(
+            f"Unsupported TTS_PROVIDER {MemoryOptimizedConfig.TTS_PROVIDER!r}; "
+            f"expected one of: {', '.join(_TTS_PROVIDERS)}"
+        )
+    
+    required = _REQUIRED_ENV
+    # Realtime sessions never construct the STT/TTS plugins
+    if not MemoryOptimizedConfig.USE_REALTIME:
+        if MemoryOptimizedConfig.STT_PROVIDER == "deepgram":
+            required += ('DEEPGRAM_API_KEY',)
+        if MemoryOptimizedConfig.TTS_PROVIDER == "cartesia":
+            required += ('CARTESIA_API_KEY',)
+    
+    missing = []
+    for var in required:
+        value = os.environ.get(var)
+        if not value or value.startswith('your_'):
+            missing.append(var)
     
     if missing:
         raise ValueError(f"Missing environment variables: {', '.join(missing)}")
 
-validate_environment()
+@functools.lru_cache(maxsize=1)
+def load_vad() -> silero.VAD:
+    """Load the Silero VAD model once per process and share it across sessions"""
+    return silero.VAD.load(
+        # Use minimal VAD settings
+        min_silence_duration=0.3,  # 300ms
+        min_speech_duration=0.15,  # 150ms
+        activation_threshold=0.3,
+    )
+
+@functools.lru_cache(maxsize=1)
+def openai_client() -> AsyncOpenAI:
+    """Shared OpenAI client so STT, LLM and TTS reuse one pooled HTTP/2 connection"""
+    return AsyncOpenAI(
+        # Retries are handled by the agent session, not the SDK
+        max_retries=0,
+        http_client=httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                # Keep connections alive across conversational pauses; the
+                # httpx default of 5s drops them between most turns
+                limits=httpx.Limits(
+                    max_keepalive_connections=32,
+                    max_connections=64,
+                    keepalive_expiry=300,
+                ),
+                retries=2,
+            ),
+        ),
+    )
+
+def prewarm(proc: agents.JobProcess):
+    """Load models before a job is assigned so sessions start without parse time"""
+    # Realtime sessions use server-side VAD, so skip loading Silero there
+    if not MemoryOptimizedConfig.USE_REALTIME:
+        load_vad()
+    openai_client()
+    # Move imports and loaded models to the permanent generation so the
+    # collector stops rescanning them during sessions
+    gc.freeze()
+
+# Built once at import and shared by every agent instance
+_INSTRUCTIONS = (
+    "Role: AndrofitAI, energetic, supportive voice gym coach. "
+    "Open with a warm greeting like 'How's your vibe today? Ready to crush it?' "
+    "Ask goals, experience, equipment and time, then build a custom plan "
+    "(e.g. 'Beginner, 20 min, no equipment' -> '20-min bodyweight HIIT: 10 squats, 10 push-ups'). "
+    "Cue each exercise, set, rep and rest step by step. Honor 'Pause', 'Skip', 'Make it easier'. "
+    "Motivate with context ('You're tough, just two more!'); give form and posture tips. "
+    "During rest, share one short fitness tip. Count reps from grunts or set a cadence. "
+    "Keep it safe, positive and personal. Reply in at most two short spoken sentences."
+)
 
 class OptimizedFitnessAssistant(Agent):
     """Memory-optimized fitness assistant with efficient resource management"""
     
     def __init__(self) -> None:
-        # Compact instructions to save memory
-        instructions=(
-                "You are AndrofitAI, an energetic, voice-interactive, and supportive AI personal gym coach. "
-                "Start every workout session with a warm, personal greeting like 'How's your vibe today? Ready to crush it?' "
-                "Prompt users to share their fitness goals, experience level, available equipment, and time, then dynamically generate customized workout plans — "
-                "For example, if a user says, 'Beginner, 20 min, no equipment,' offer a suitable plan such as '20-min bodyweight HIIT: 10 squats, 10 push-ups.' "
-                "Guide workouts in real time with step-by-step verbal instructions, providing clear cues for each exercise, set, rep, and rest interval — "
-                "Support voice commands like 'Pause,' 'Skip,' or 'Make it easier' to ensure users feel in control. "
-                "Consistently deliver motivational, context-aware feedback—if a user expresses fatigue, reassure them with, 'You're tough, just two more!' "
-                "Share essential form and technique tips by describing correct posture and alignment, and confidently answer questions like 'How's a deadlift done?' "
-                "Adopt an authentic personal trainer style: build rapport with empathetic, conversational exchanges and respond to user mood or progress. "
-                "During rest intervals, initiate brief, engaging fitness discussions—for example, 'Protein aids recovery; try eggs post-workout.' "
-                "Accurately count reps using user grunts, or offer a motivating cadence to keep users on pace, cheering them through every set. "
-                "Always focus on making each session positive, safe, goal-oriented, and truly personalized."
-            )
-        
-        super().__init__(instructions=instructions)
+        super().__init__(instructions=_INSTRUCTIONS)
+
+def greeting_audio_path() -> str:
+    """Cache file for the greeting, keyed by everything that changes its audio"""
+    if MemoryOptimizedConfig.GREETING_AUDIO_PATH:
+        return MemoryOptimizedConfig.GREETING_AUDIO_PATH
+    
+    if MemoryOptimizedConfig.TTS_PROVIDER == "cartesia":
+        voice_settings = (MemoryOptimizedConfig.CARTESIA_TTS_MODEL,)
+    else:
+        voice_settings = (MemoryOptimizedConfig.TTS_MODEL, MemoryOptimizedConfig.TTS_VOICE)
+    key = "|".join((MemoryOptimizedConfig.GREETING, *voice_settings))
+    digest = hashlib.sha256(key.encode()).hexdigest()[:12]
+    return f"greeting-{MemoryOptimizedConfig.TTS_PROVIDER}-{digest}.wav"
+
+def read_greeting_cache(path: str) -> list[rtc.AudioFrame]:
+    """Load the cached greeting as 16-bit PCM frames, or [] if it is unusable"""
+    if not os.path.exists(path):
+        return []
+    
+    # Read the whole file up front so a bad file never plays half a greeting
+    frames = []
+    try:
+        with wave.open(path, "rb") as wav:
+            sample_rate = wav.getframerate()
+            num_channels = wav.getnchannels()
+            if wav.getsampwidth() != 2 or sample_rate < 10:
+                raise wave.Error("expected 16-bit PCM")
+            # Split into 100ms frames
+            while data := wav.readframes(sample_rate // 10):
+                frames.append(rtc.AudioFrame(
+                    data=data,
+                    sample_rate=sample_rate,
+                    num_channels=num_channels,
+                    samples_per_channel=len(data) // (2 * num_channels),
+                ))
+    except (OSError, EOFError, ValueError, wave.Error) as e:
+        logger.warning("ignoring greeting cache %s: %r", path, e)
+        return []
+    return frames
+
+async def greeting_audio(tts) -> AsyncIterator[rtc.AudioFrame]:
+    """Replay the cached greeting audio, synthesizing and caching it on first use"""
+    path = greeting_audio_path()
+    cached = read_greeting_cache(path)
+    if cached:
+        for frame in cached:
+            yield frame
+        return
+    
+    frames = []
+    async with tts.synthesize(MemoryOptimizedConfig.GREETING) as stream:
+        async for audio in stream:
+            frames.append(audio.frame)
+            yield audio.frame
+    
+    if not frames:
+        return
+    
+    # Only reached when the greeting played in full; write atomically so
+    # concurrent job processes never read a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f, wave.open(f, "wb") as wav:
+            wav.setnchannels(frames[0].num_channels)
+            wav.setsampwidth(2)
+            wav.setframerate(frames[0].sample_rate)
+            wav.writeframes(b"".join(bytes(frame.data) for frame in frames))
+        os.replace(tmp_path, path)
+    except (OSError, wave.Error) as e:
+        logger.warning("greeting cache error: %s", e)
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+def create_stt():
+    """Build the STT plugin selected by STT_PROVIDER"""
+    if MemoryOptimizedConfig.STT_PROVIDER == "deepgram":
+        # Streams audio over a websocket so transcripts arrive while the
+        # user is still speaking, instead of one upload per utterance
+        return deepgram.STT(
+            model=MemoryOptimizedConfig.DEEPGRAM_STT_MODEL,
+            language=MemoryOptimizedConfig.STT_LANGUAGE,
+            interim_results=True,
+            smart_format=False,
+            endpointing_ms=150,
+        )
+    return openai.STT(
+        model=MemoryOptimizedConfig.STT_MODEL,
+        language=MemoryOptimizedConfig.STT_LANGUAGE,
+        prompt=MemoryOptimizedConfig.STT_PROMPT,
+        client=openai_client(),
+    )
+
+def create_tts():
+    """Build the TTS plugin selected by TTS_PROVIDER"""
+    if MemoryOptimizedConfig.TTS_PROVIDER == "cartesia":
+        # Keeps one websocket open and streams audio as text arrives
+        return cartesia.TTS(
+            model=MemoryOptimizedConfig.CARTESIA_TTS_MODEL,
+            language=MemoryOptimizedConfig.TTS_LANGUAGE,
+        )
+    return openai.TTS(
+        model=MemoryOptimizedConfig.TTS_MODEL,
+        voice=MemoryOptimizedConfig.TTS_VOICE,
+        client=openai_client(),
+    )
 
 @asynccontextmanager
 async def create_optimized_session(ctx: agents.JobContext):
     """Create session with memory optimization"""
     session = None
     try:
+        if MemoryOptimizedConfig.USE_REALTIME:
+            # Server-side VAD and turn detection, no local STT/TTS/VAD
+            session = AgentSession(
+                llm=openai.realtime.RealtimeModel(
+                    model=MemoryOptimizedConfig.REALTIME_MODEL,
+                    voice=MemoryOptimizedConfig.TTS_VOICE,
+                ),
+            )
+            yield session
+            return
+        
         # Initialize with minimal memory footprint
         session = AgentSession(
-            stt=openai.STT(
-                model=MemoryOptimizedConfig.STT_MODEL,
-                # Reduce audio processing quality for memory savings
-            ),
+            stt=create_stt(),
             llm=openai.LLM(
                 model=MemoryOptimizedConfig.LLM_MODEL,
+                client=openai_client(),
                 temperature=0.7,
                 # Removed max_tokens - handle this in agent instructions instead
             ),
-            tts=openai.TTS(
-                model=MemoryOptimizedConfig.TTS_MODEL,
-                voice=MemoryOptimizedConfig.TTS_VOICE,
-            ),
-            vad=silero.VAD.load(
-                # Use minimal VAD settings
-                min_silence_duration=0.5,  # 500ms
-                min_speech_duration=0.25,  # 250ms
+            tts=create_tts(),
+            vad=load_vad(),
+            # Start drafting the reply from partial transcripts so LLM
+            # prefill overlaps the tail of user speech
+            preemptive_generation=True,
+            # Use simple turn detection based on VAD only, with a short
+            # endpointing delay instead of a transformer turn detector
+            min_endpointing_delay=0.15,
+            max_endpointing_delay=2.0,
+            conn_options=SessionConnectOptions(
+                llm_conn_options=APIConnectOptions(
+                    max_retry=MemoryOptimizedConfig.REQUEST_RETRIES,
+                    retry_interval=MemoryOptimizedConfig.RETRY_INTERVAL,
+                    timeout=MemoryOptimizedConfig.LLM_TIMEOUT,
+                ),
+                tts_conn_options=APIConnectOptions(
+                    max_retry=MemoryOptimizedConfig.REQUEST_RETRIES,
+                    retry_interval=MemoryOptimizedConfig.RETRY_INTERVAL,
+                    timeout=MemoryOptimizedConfig.TTS_TIMEOUT,
+                ),
             ),
-            # Use simple turn detection based on VAD only
-            # turn_detection=MultilingualModel(),  # Removed - requires model download
         )
         
         yield session
         
     except Exception as e:
-        print(f"Session initialization error: {e}")
+        logger.error("session initialization error: %s", e)
         raise
     finally:
         # Cleanup resources
@@ -97,8 +344,18 @@ async def create_optimized_session(ctx: agents.JobContext):
             except:
                 pass
 
+async def warm_connections():
+    """Open the pooled OpenAI connection before the first user turn needs it"""
+    try:
+        await openai_client().models.list()
+    except Exception as e:
+        logger.debug("connection warmup failed: %s", e)
+
 async def entrypoint(ctx: agents.JobContext):
     """Optimized entrypoint with proper resource management"""
+    # Handshake with OpenAI while the room connects; STT, LLM and TTS then
+    # find a warm keep-alive connection in the shared pool
+    warmup = asyncio.create_task(warm_connections())
     try:
         async with create_optimized_session(ctx) as session:
             # Create agent instance
@@ -111,59 +368,106 @@ async def entrypoint(ctx: agents.JobContext):
                 # Removed RoomInputOptions as it might not be needed or have different parameters
             )
             
-            # Send initial greeting - removed max_tokens parameter
-            await session.say(
-                "Hello! I'm AndrofitAI, your personal AI fitness coach. What are your fitness goals today?",
-                allow_interruptions=True
-            )
+            if MemoryOptimizedConfig.USE_REALTIME:
+                # Realtime sessions have no TTS plugin; the model speaks directly
+                await session.generate_reply(
+                    instructions=f"Greet the user with: {MemoryOptimizedConfig.GREETING}"
+                )
+            else:
+                # Send initial greeting from cached audio, skipping the TTS roundtrip
+                await session.say(
+                    MemoryOptimizedConfig.GREETING,
+                    audio=greeting_audio(session.tts),
+                    allow_interruptions=True
+                )
             
-            # Keep session alive and handle the conversation
-            while ctx.room.connection_state == "connected":
-                await asyncio.sleep(1)  # Check more frequently for responsiveness
+            # Keep session alive until the room disconnects, without polling
+            disconnected = asyncio.Event()
+            ctx.room.on("disconnected", lambda *_: disconnected.set())
+            if ctx.room.isconnected():
+                await disconnected.wait()
                 
     except Exception as e:
-        print(f"Session error: {e}")
+        logger.error("session error: %s", e)
         raise
+    finally:
+        warmup.cancel()
+
+def _mask(value: Optional[str]) -> str:
+    """Summarize a secret or URL for logs without revealing it"""
+    if not value or value.startswith(('your_', 'wss://your-')):
+        return "MISSING"
+    return f"...{value[-4:]}"
 
 def main():
     """Main function with error handling and resource monitoring"""
+    # Own handler instead of a root basicConfig: livekit's CLI installs its
+    # root handler later, and both would print every record twice
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
     try:
-        print("🚀 Starting AndrofitAI (Memory Optimized)")
-        print(f"📊 Python memory limit: ~512MB")
-        print(f"✅ OpenAI: {'OK' if os.getenv('OPENAI_API_KEY') and not os.getenv('OPENAI_API_KEY').startswith('your_') else 'MISSING'}")
-        print(f"✅ LiveKit: {'OK' if os.getenv('LIVEKIT_URL') and not os.getenv('LIVEKIT_URL').startswith('wss://your-') else 'MISSING'}")
+        validate_environment()
+        if MemoryOptimizedConfig.USE_REALTIME:
+            logger.info(
+                "androfit start: realtime=%s openai=%s livekit=%s",
+                MemoryOptimizedConfig.REALTIME_MODEL,
+                _mask(os.environ.get('OPENAI_API_KEY')),
+                _mask(os.environ.get('LIVEKIT_URL')),
+            )
+        else:
+            logger.info(
+                "androfit start: stt=%s/%s llm=%s tts=%s/%s openai=%s livekit=%s",
+                MemoryOptimizedConfig.STT_PROVIDER,
+                MemoryOptimizedConfig.DEEPGRAM_STT_MODEL
+                if MemoryOptimizedConfig.STT_PROVIDER == "deepgram"
+                else MemoryOptimizedConfig.STT_MODEL,
+                MemoryOptimizedConfig.LLM_MODEL,
+                MemoryOptimizedConfig.TTS_PROVIDER,
+                MemoryOptimizedConfig.CARTESIA_TTS_MODEL
+                if MemoryOptimizedConfig.TTS_PROVIDER == "cartesia"
+                else MemoryOptimizedConfig.TTS_MODEL,
+                _mask(os.environ.get('OPENAI_API_KEY')),
+                _mask(os.environ.get('LIVEKIT_URL')),
+            )
         
         # Configure worker options
         worker_options = agents.WorkerOptions(
             entrypoint_fnc=entrypoint,
+            prewarm_fnc=prewarm,
             ws_url=os.getenv("LIVEKIT_URL"),
             api_key=os.getenv("LIVEKIT_API_KEY"),
             api_secret=os.getenv("LIVEKIT_API_SECRET"),
+            # Health checks are answered by the worker's own HTTP server on
+            # the agent event loop - no extra thread or web framework needed
+            port=int(os.getenv("PORT", "8081")),
         )
         
         # Run with cleanup
         agents.cli.run_app(worker_options)
         
     except KeyboardInterrupt:
-        print("\n⏹️  Shutting down gracefully...")
+        logger.info("shutting down gracefully")
     except ValueError as e:
-        print(f"❌ Configuration Error: {e}")
-        print("\n💡 Create a .env file with:")
-        print("OPENAI_API_KEY=your_openai_key_here")
-        print("LIVEKIT_API_KEY=your_livekit_key_here")
-        print("LIVEKIT_API_SECRET=your_livekit_secret_here")
-        print("LIVEKIT_URL=your_livekit_url_here")
+        logger.error(
+            "configuration error: %s\n"
+            "create a .env file with OPENAI_API_KEY, LIVEKIT_API_KEY, "
+            "LIVEKIT_API_SECRET and LIVEKIT_URL",
+            e,
+        )
         return 1
     except Exception as e:
-        print(f"❌ Startup Error: {e}")
-        print("\n🔧 Troubleshooting:")
-        print("1. Check your .env file configuration")
-        print("2. Verify internet connection")
-        print("3. Ensure API keys are valid")
-        print("4. Check LiveKit server accessibility")
+        logger.error(
+            "startup error: %s\n"
+            "check the .env configuration, internet connection, API keys "
+            "and LiveKit server accessibility",
+            e,
+        )
         return 1
     finally:
-        print("🏁 Shutdown complete")
+        logger.info("shutdown complete")
     
     return 0
 